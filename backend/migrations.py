@@ -0,0 +1,314 @@
+"""
+Migrations de schéma pour les documents MongoDB.
+
+Chaque document porte un champ `schema_version`. Les migrations sont appliquées
+en ligne, par lots, avec une pause entre chaque lot pour ne pas saturer le
+primaire, et reprennent là où elles s'étaient arrêtées grâce à un point de
+reprise stocké dans la collection `migrations_state`.
+
+Pendant le déploiement, les lecteurs rencontrent des documents de versions
+différentes : `upgrade_document` applique en mémoire les migrations manquantes
+pour que le reste du code ne voie que la version courante.
+
+Utilisation en ligne de commande (depuis le dossier backend) :
+
+    python migrations.py [--batch-size 500] [--pause 0.1] [--contract]
+
+Les changements de schéma suivent le schéma expand/contract : une migration
+ajoute d'abord les nouveaux champs en gardant les anciens, et une migration
+« contract » distincte supprime les anciens une fois toutes les instances à jour.
+"""
+
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_PAUSE_SECONDS = 0.1
+LEASE_SECONDS = 60
+
+# Une fonction de migration reçoit un document et renvoie les champs à
+# positionner ($set) et les champs à supprimer ($unset).
+MigrationFn = Callable[[dict], Tuple[Dict, List[str]]]
+
+
+class Migration:
+    """
+    Migration d'une collection vers `version`.
+
+    Les migrations « contract » suppriment des champs encore lus par d'anciennes
+    instances : elles ne sont jamais appliquées automatiquement et ne se lancent
+    qu'explicitement, une fois toutes les instances déployées sur le nouveau code.
+    """
+
+    def __init__(self, collection: str, version: int, description: str, up: MigrationFn, contract: bool = False):
+        self.collection = collection
+        self.version = version
+        self.description = description
+        self.up = up
+        self.contract = contract
+
+    @property
+    def name(self) -> str:
+        return f"{self.collection}_v{self.version}"
+
+
+def euros_to_cents(value) -> int:
+    """Convertit un montant en euros (float ou str) en centimes entiers."""
+    return int((Decimal(str(value)) * 100).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+
+
+def cents_to_euros(cents: int) -> float:
+    return float(Decimal(cents) / 100)
+
+
+def multiply_cents(cents: int, factor) -> int:
+    """Multiplie un montant en centimes par une quantité ou un taux, arrondi au centime."""
+    return int((Decimal(cents) * Decimal(str(factor))).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+
+
+# Migrations de la collection devis
+DEVIS_MONEY_FIELDS = ("prix_unitaire", "prix_ht", "montant_tva", "prix_ttc")
+
+
+def _devis_money_to_cents(doc: dict) -> Tuple[Dict, List[str]]:
+    # Les montants stockés sont convertis tels quels : une facture émise garde
+    # son montant. Les champs en euros restent pour les instances pas encore à jour.
+    set_fields = {f"{field}_cents": euros_to_cents(doc.get(field, 0)) for field in DEVIS_MONEY_FIELDS}
+    return set_fields, []
+
+
+def _devis_drop_euro_fields(doc: dict) -> Tuple[Dict, List[str]]:
+    return {}, list(DEVIS_MONEY_FIELDS)
+
+
+MIGRATIONS: List[Migration] = [
+    Migration("devis", 2, "Montants en centimes entiers", _devis_money_to_cents),
+    Migration("devis", 3, "Suppression des montants en euros", _devis_drop_euro_fields, contract=True),
+]
+
+
+def current_version(collection: str) -> int:
+    """Version écrite par l'application : la dernière migration hors « contract »."""
+    versions = [m.version for m in MIGRATIONS if m.collection == collection and not m.contract]
+    return max(versions, default=1)
+
+
+def pending_migrations(collection: str, from_version: int, include_contract: bool = False) -> List[Migration]:
+    return sorted(
+        (
+            m for m in MIGRATIONS
+            if m.collection == collection and m.version > from_version and (include_contract or not m.contract)
+        ),
+        key=lambda m: m.version,
+    )
+
+
+def upgrade_document(collection: str, doc: Optional[dict]) -> Optional[dict]:
+    """Met à niveau en mémoire un document lu, quelle que soit sa version."""
+    if doc is None:
+        return None
+    version = doc.get("schema_version", 1)
+    for migration in pending_migrations(collection, version):
+        set_fields, unset_fields = migration.up(doc)
+        for field in unset_fields:
+            doc.pop(field, None)
+        doc.update(set_fields)
+        doc["schema_version"] = migration.version
+    return doc
+
+
+def _older_than(version: int) -> dict:
+    # Les documents antérieurs au versionnement n'ont pas de champ schema_version
+    return {"$or": [{"schema_version": {"$exists": False}}, {"schema_version": {"$lt": version}}]}
+
+
+def _version_filter(version: int) -> dict:
+    if version == 1:
+        return {"$or": [{"schema_version": {"$exists": False}}, {"schema_version": 1}]}
+    return {"schema_version": version}
+
+
+def _build_update(migration: Migration, doc: dict) -> UpdateOne:
+    """
+    Met le document à la version de `migration` en appliquant toute la chaîne
+    depuis sa propre version : une migration « contract » sur un document v1
+    écrit donc aussi les champs des migrations intermédiaires.
+
+    La mise à jour est conditionnée à la version lue : un document réécrit
+    entre-temps par l'application n'est pas écrasé.
+    """
+    version = doc.get("schema_version", 1)
+    upgraded = dict(doc)
+    set_fields, unset_fields = {}, set()
+    for step in pending_migrations(migration.collection, version, include_contract=True):
+        if step.version > migration.version:
+            break
+        step_set, step_unset = step.up(upgraded)
+        for field in step_unset:
+            upgraded.pop(field, None)
+            set_fields.pop(field, None)
+            unset_fields.add(field)
+        upgraded.update(step_set)
+        set_fields.update(step_set)
+        unset_fields.difference_update(step_set)
+    set_fields["schema_version"] = migration.version
+    update = {"$set": set_fields}
+    if unset_fields:
+        update["$unset"] = {field: "" for field in sorted(unset_fields)}
+    return UpdateOne({"$and": [{"_id": doc["_id"]}, _version_filter(version)]}, update)
+
+
+async def _acquire_lease(db, migration: Migration, owner: str) -> Optional[dict]:
+    """Prend le verrou de la migration, sauf si une autre instance détient un bail en cours."""
+    now = datetime.utcnow()
+    try:
+        return await db.migrations_state.find_one_and_update(
+            {"_id": migration.name, "$or": [{"status": {"$ne": "running"}}, {"lease_until": {"$lt": now}}]},
+            {
+                "$set": {"status": "running", "owner": owner, "lease_until": now + timedelta(seconds=LEASE_SECONDS)},
+                "$setOnInsert": {"started_at": now},
+            },
+            upsert=True,
+            return_document=ReturnDocument.BEFORE,
+        ) or {}
+    except DuplicateKeyError:
+        return None
+
+
+async def run_migration(
+    db,
+    migration: Migration,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    pause: float = DEFAULT_PAUSE_SECONDS,
+) -> Optional[int]:
+    """
+    Applique une migration par lots triés sur _id.
+
+    Le dernier _id traité est enregistré après chaque lot, ce qui permet de
+    reprendre après un arrêt. Une seule instance migre à la fois grâce à un bail
+    dans `migrations_state` ; renvoie None si le bail est détenu ailleurs ou perdu
+    en cours de route, c'est-à-dire si la migration n'est pas terminée.
+
+    Un dernier passage depuis le début reprend les documents insérés entre-temps
+    par d'anciennes instances, y compris après une migration déjà terminée.
+    """
+    collection = db[migration.collection]
+    owner = str(uuid.uuid4())
+    state = await _acquire_lease(db, migration, owner)
+    if state is None:
+        logger.info(f"Migration {migration.name}: déjà en cours sur une autre instance")
+        return None
+
+    try:
+        # Sans index, la vérification « déjà terminée » et le passage final
+        # parcourraient toute la collection sur le primaire
+        await collection.create_index("schema_version")
+
+        if state.get("status") == "done" and not await collection.find_one(_older_than(migration.version)):
+            await db.migrations_state.update_one(
+                {"_id": migration.name, "owner": owner},
+                {"$set": {"status": "done", "lease_until": None}},
+            )
+            return 0
+
+        last_id = None if state.get("status") == "done" else state.get("last_id")
+        final_sweep = False
+        migrated = 0
+
+        while True:
+            query = _older_than(migration.version)
+            if last_id is not None:
+                query = {"$and": [query, {"_id": {"$gt": last_id}}]}
+            batch = await collection.find(query).sort("_id", 1).limit(batch_size).to_list(batch_size)
+
+            if batch:
+                result = await collection.bulk_write([_build_update(migration, doc) for doc in batch], ordered=False)
+                migrated += result.modified_count
+                last_id = batch[-1]["_id"]
+                renewed = await db.migrations_state.update_one(
+                    {"_id": migration.name, "owner": owner},
+                    {
+                        "$set": {
+                            "last_id": last_id,
+                            "updated_at": datetime.utcnow(),
+                            "lease_until": datetime.utcnow() + timedelta(seconds=LEASE_SECONDS),
+                        },
+                        "$inc": {"migrated": result.modified_count},
+                    },
+                )
+                if renewed.matched_count == 0:
+                    logger.warning(f"Migration {migration.name}: bail perdu, arrêt")
+                    return None
+                logger.info(f"Migration {migration.name}: {migrated} documents migrés")
+
+            if len(batch) == batch_size:
+                await asyncio.sleep(pause)
+                continue
+            if final_sweep:
+                break
+            # Les ObjectId ne sont pas strictement croissants entre instances :
+            # on repasse depuis le début, seuls les documents restants sont lus
+            final_sweep = True
+            last_id = None
+
+        await db.migrations_state.update_one(
+            {"_id": migration.name, "owner": owner},
+            {"$set": {"status": "done", "lease_until": None, "finished_at": datetime.utcnow()}},
+        )
+        return migrated
+    except BaseException as exc:
+        # Le bail est libéré pour qu'une autre instance puisse reprendre depuis last_id
+        status = "failed" if isinstance(exc, Exception) else "interrupted"
+        await db.migrations_state.update_one(
+            {"_id": migration.name, "owner": owner},
+            {"$set": {"status": status, "lease_until": None, "error": repr(exc)}},
+        )
+        raise
+
+
+async def run_all_migrations(
+    db,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    pause: float = DEFAULT_PAUSE_SECONDS,
+    include_contract: bool = False,
+) -> None:
+    for migration in sorted(MIGRATIONS, key=lambda m: (m.collection, m.version)):
+        if migration.contract and not include_contract:
+            continue
+        logger.info(f"Migration {migration.name}: {migration.description}")
+        await run_migration(db, migration, batch_size=batch_size, pause=pause)
+        state = await db.migrations_state.find_one({"_id": migration.name})
+        if not state or state.get("status") != "done":
+            # Migration inachevée (autre instance, bail perdu) : les suivantes attendront
+            logger.info(f"Migration {migration.name}: inachevée, migrations suivantes reportées")
+            return
+
+
+if __name__ == "__main__":
+    import argparse
+    from pathlib import Path
+
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Exécute les migrations de schéma en attente")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--pause", type=float, default=DEFAULT_PAUSE_SECONDS, help="pause entre deux lots, en secondes")
+    parser.add_argument("--contract", action="store_true",
+                        help="applique aussi les migrations qui suppriment des champs (toutes les instances doivent être à jour)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    load_dotenv(Path(__file__).parent / '.env')
+    mongo_client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    asyncio.run(run_all_migrations(mongo_client[os.environ['DB_NAME']], args.batch_size, args.pause, args.contract))
@@ -0,0 +1,184 @@
+"""
+Profilage à la demande des requêtes HTTP.
+
+Une requête est profilée si elle porte l'en-tête `X-Profile` avec le jeton
+d'administration (PROFILING_ADMIN_TOKEN), ou si elle est tirée au sort selon
+PROFILING_SAMPLE_RATE. Un thread échantillonne alors, à intervalle régulier,
+la pile de coroutines de la tâche qui traite la requête : le temps passé à
+attendre Motor apparaît donc dans le profil, et pas seulement le temps CPU.
+
+Les profils sont conservés dans un tampon circulaire borné et exportés au
+format « folded stacks » (une ligne `pile;de;fonctions nombre`), utilisable
+directement par flamegraph.pl ou speedscope.
+
+Quand aucune requête n'est profilée, le middleware se limite à une lecture
+d'en-tête et, si un taux d'échantillonnage est configuré, à un tirage aléatoire.
+"""
+
+import asyncio
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from datetime import datetime
+from typing import Deque, List, Optional
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_ID_HEADER = b"x-profile-id"
+
+
+class RequestProfile:
+    def __init__(self, method: str, path: str):
+        self.id = str(uuid.uuid4())
+        self.method = method
+        self.path = path
+        self.started_at = datetime.utcnow()
+        self.duration_ms: Optional[float] = None
+        self.samples: Counter = Counter()
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "sample_count": sum(self.samples.values()),
+        }
+
+    def folded(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common())
+
+
+class ProfileStore:
+    """Tampon circulaire des derniers profils capturés."""
+
+    def __init__(self, size: int):
+        self._profiles: Deque[RequestProfile] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, profile: RequestProfile) -> None:
+        with self._lock:
+            self._profiles.append(profile)
+
+    def list(self) -> List[RequestProfile]:
+        with self._lock:
+            return list(reversed(self._profiles))
+
+    def get(self, profile_id: str) -> Optional[RequestProfile]:
+        with self._lock:
+            return next((p for p in self._profiles if p.id == profile_id), None)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _task_stack(task: asyncio.Task, loop_thread_id: int) -> List[str]:
+    """
+    Reconstitue la pile d'une tâche, de la coroutine racine vers la plus profonde.
+
+    Si la tâche est suspendue, la pile se termine par l'objet attendu (par exemple
+    le Future d'un appel Motor). Si elle s'exécute, on complète avec les frames
+    synchrones appelées depuis la coroutine la plus profonde.
+    """
+    frames = []
+    awaited = None
+    coro = task.get_coro()
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        frames.append(frame)
+        awaited = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+        if awaited is None or not hasattr(awaited, "cr_frame") and not hasattr(awaited, "gi_frame"):
+            break
+        coro = awaited
+
+    stack = [_frame_label(frame) for frame in frames]
+    if not frames:
+        return stack
+
+    if getattr(coro, "cr_running", False) or getattr(coro, "gi_running", False):
+        inner = []
+        frame = sys._current_frames().get(loop_thread_id)
+        while frame is not None and frame is not frames[-1]:
+            inner.append(_frame_label(frame))
+            frame = frame.f_back
+        if frame is not None:
+            stack.extend(reversed(inner))
+    elif awaited is not None:
+        stack.append(f"<await {type(awaited).__name__}>")
+    return stack
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, profile: RequestProfile, task: asyncio.Task, interval: float):
+        super().__init__(daemon=True)
+        self.profile = profile
+        self.task = task
+        self.interval = interval
+        self.loop_thread_id = threading.get_ident()
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            stack = _task_stack(self.task, self.loop_thread_id)
+            if stack:
+                self.profile.samples[";".join(stack)] += 1
+
+    def stop(self) -> None:
+        # Ne bloque pas : le thread s'arrête au plus tard après l'échantillon en cours
+        self._stop_event.set()
+
+
+class ProfilingMiddleware:
+    """Middleware ASGI qui profile les requêtes sélectionnées et les range dans `store`."""
+
+    def __init__(self, app, store: ProfileStore, admin_token: str = "", sample_rate: float = 0.0,
+                 interval: float = 0.005):
+        self.app = app
+        self.store = store
+        self.admin_token = admin_token.encode()
+        self.sample_rate = sample_rate
+        self.interval = interval
+
+    def _should_profile(self, scope) -> bool:
+        if self.admin_token:
+            for name, value in scope["headers"]:
+                if name == PROFILE_HEADER:
+                    if hmac.compare_digest(value, self.admin_token):
+                        return True
+                    break
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"])
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (PROFILE_ID_HEADER, profile.id.encode())
+                ]
+            await send(message)
+
+        sampler = _Sampler(profile, asyncio.current_task(), self.interval)
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profile.duration_ms = (time.perf_counter() - start) * 1000
+            sampler.stop()
+            # Attendre la fin du thread hors de la boucle, avant d'exposer le profil
+            await asyncio.to_thread(sampler.join)
+            self.store.add(profile)
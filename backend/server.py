@@ -1,14 +1,20 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Header
+from fastapi.responses import PlainTextResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.read_preferences import SecondaryPreferred
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
 from typing import List, Optional
 import uuid
+import hmac
 from datetime import datetime, timedelta
+import asyncio
+from profiling import ProfileStore, ProfilingMiddleware
+from migrations import DEVIS_MONEY_FIELDS, cents_to_euros, current_version, euros_to_cents, multiply_cents, run_all_migrations, upgrade_document
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -18,9 +24,43 @@ mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
+# Lectures de liste et d'analyse routées vers les secondaires pour ne pas concurrencer
+# les écritures de devis sur le primaire. Les lectures qui suivent une écriture
+# (get_devis après create_devis, conversion en facture, listes rechargées avec
+# fresh=true) restent sur `db` (primaire).
+# MongoDB impose un maxStalenessSeconds d'au moins 90 secondes : une valeur plus
+# faible n'échouerait qu'à la sélection du serveur, on la refuse dès le chargement.
+MIN_READ_MAX_STALENESS_SECONDS = 90
+
+def parse_read_max_staleness(value) -> int:
+    max_staleness = int(value)
+    if max_staleness < MIN_READ_MAX_STALENESS_SECONDS:
+        raise ValueError(
+            f"READ_MAX_STALENESS_SECONDS doit valoir au moins {MIN_READ_MAX_STALENESS_SECONDS} (reçu {max_staleness})"
+        )
+    return max_staleness
+
+read_max_staleness = parse_read_max_staleness(os.environ.get('READ_MAX_STALENESS_SECONDS', MIN_READ_MAX_STALENESS_SECONDS))
+
+def secondary_database(mongo_client: AsyncIOMotorClient):
+    return mongo_client.get_database(
+        os.environ['DB_NAME'],
+        read_preference=SecondaryPreferred(max_staleness=read_max_staleness)
+    )
+
+secondary_db = secondary_database(client)
+
+def list_db(fresh: bool):
+    """Base pour les lectures de liste : le primaire si le client vient d'écrire."""
+    return db if fresh else secondary_db
+
 # Create the main app without a prefix
 app = FastAPI()
 
+# Profilage à la demande : en-tête X-Profile avec le jeton admin, ou taux d'échantillonnage
+profiling_admin_token = os.environ.get('PROFILING_ADMIN_TOKEN', '')
+profile_store = ProfileStore(int(os.environ.get('PROFILING_BUFFER_SIZE', 50)))
+
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
@@ -85,6 +125,21 @@ class Devis(BaseModel):
     is_facture: bool = False
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+def devis_money_fields(**montants_cents: int) -> dict:
+    """Champs montants d'un devis : centimes, plus les euros encore lus par les anciennes instances."""
+    fields = {}
+    for name, cents in montants_cents.items():
+        fields[f"{name}_cents"] = cents
+        fields[name] = cents_to_euros(cents)
+    return fields
+
+def devis_from_document(doc: dict) -> Devis:
+    """Construit un Devis à partir d'un document stocké, quelle que soit sa version de schéma."""
+    doc = upgrade_document("devis", doc)
+    montants = {field: cents_to_euros(doc[f"{field}_cents"]) for field in DEVIS_MONEY_FIELDS}
+    exclus = {"schema_version", *DEVIS_MONEY_FIELDS, *(f"{field}_cents" for field in DEVIS_MONEY_FIELDS)}
+    return Devis(**montants, **{k: v for k, v in doc.items() if k not in exclus})
+
 class DevisCreate(BaseModel):
     client: Client
     type_prestation: str
@@ -140,50 +195,58 @@ async def create_devis(devis_data: DevisCreate):
         if not devis_data.nombre_kilometres:
             raise HTTPException(status_code=400, detail="Nombre de kilomètres requis pour un transfert")
         prix_unitaire = company_settings.get("tarif_transfert_km", 2.0)  # Utiliser tarif configuré
-        prix_ht = devis_data.nombre_kilometres * prix_unitaire
+        quantite = devis_data.nombre_kilometres
         taux_tva = 0.10  # 10% TVA
     elif devis_data.type_prestation == "mise_a_disposition":
         if not devis_data.nombre_heures:
             raise HTTPException(status_code=400, detail="Nombre d'heures requis pour une mise à disposition")
         prix_unitaire = company_settings.get("tarif_mise_disposition_h", 80.0)  # Utiliser tarif configuré
-        prix_ht = devis_data.nombre_heures * prix_unitaire
+        quantite = devis_data.nombre_heures
         taux_tva = 0.20  # 20% TVA
     else:
         raise HTTPException(status_code=400, detail="Type de prestation invalide")
     
-    montant_tva = prix_ht * taux_tva
-    prix_ttc = prix_ht + montant_tva
+    # Calculs en centimes entiers, arrondis au centime à chaque étape
+    prix_unitaire_cents = euros_to_cents(prix_unitaire)
+    prix_ht_cents = multiply_cents(prix_unitaire_cents, quantite)
+    montant_tva_cents = multiply_cents(prix_ht_cents, taux_tva)
     
     # Date de validité (30 jours)
     date_validite = datetime.now() + timedelta(days=30)
     
-    # Création du devis
-    devis_dict = devis_data.dict()
-    devis_obj = Devis(
-        numero_devis=numero_devis,
-        date_validite=date_validite,
-        prix_unitaire=prix_unitaire,
-        prix_ht=prix_ht,
-        taux_tva=taux_tva,
-        montant_tva=montant_tva,
-        prix_ttc=prix_ttc,
-        **devis_dict
-    )
+    # Création du devis : les montants sont figés à la création, en centimes
+    devis_doc = {
+        "id": str(uuid.uuid4()),
+        "schema_version": current_version("devis"),
+        "numero_devis": numero_devis,
+        "date_creation": datetime.utcnow(),
+        "date_validite": date_validite,
+        "taux_tva": taux_tva,
+        **devis_money_fields(
+            prix_unitaire=prix_unitaire_cents,
+            prix_ht=prix_ht_cents,
+            montant_tva=montant_tva_cents,
+            prix_ttc=prix_ht_cents + montant_tva_cents,
+        ),
+        "is_facture": False,
+        "created_at": datetime.utcnow(),
+        **devis_data.dict()
+    }
     
-    await db.devis.insert_one(devis_obj.dict())
-    return devis_obj
+    await db.devis.insert_one(devis_doc)
+    return devis_from_document(devis_doc)
 
 @api_router.get("/devis", response_model=List[Devis])
-async def get_all_devis():
-    devis_list = await db.devis.find().sort("created_at", -1).to_list(1000)
-    return [Devis(**devis) for devis in devis_list]
+async def get_all_devis(fresh: bool = False):
+    devis_list = await list_db(fresh).devis.find().sort("created_at", -1).to_list(1000)
+    return [devis_from_document(devis) for devis in devis_list]
 
 @api_router.get("/devis/{devis_id}", response_model=Devis)
 async def get_devis(devis_id: str):
     devis = await db.devis.find_one({"id": devis_id})
     if not devis:
         raise HTTPException(status_code=404, detail="Devis non trouvé")
-    return Devis(**devis)
+    return devis_from_document(devis)
 
 @api_router.put("/devis/{devis_id}/convert-to-facture", response_model=Devis)
 async def convert_to_facture(devis_id: str):
@@ -198,12 +261,31 @@ async def convert_to_facture(devis_id: str):
     )
     
     updated_devis = await db.devis.find_one({"id": devis_id})
-    return Devis(**updated_devis)
+    return devis_from_document(updated_devis)
 
 @api_router.get("/factures", response_model=List[Devis])
-async def get_all_factures():
-    factures_list = await db.devis.find({"is_facture": True}).sort("created_at", -1).to_list(1000)
-    return [Devis(**facture) for facture in factures_list]
+async def get_all_factures(fresh: bool = False):
+    factures_list = await list_db(fresh).devis.find({"is_facture": True}).sort("created_at", -1).to_list(1000)
+    return [devis_from_document(facture) for facture in factures_list]
+
+# Routes d'administration pour les profils de requêtes
+def check_profiling_admin(token: Optional[str]):
+    if not profiling_admin_token or not hmac.compare_digest((token or "").encode(), profiling_admin_token.encode()):
+        raise HTTPException(status_code=403, detail="Accès refusé")
+
+@api_router.get("/admin/profiles")
+async def list_profiles(x_admin_token: Optional[str] = Header(None)):
+    check_profiling_admin(x_admin_token)
+    return [profile.summary() for profile in profile_store.list()]
+
+@api_router.get("/admin/profiles/{profile_id}", response_class=PlainTextResponse)
+async def get_profile(profile_id: str, x_admin_token: Optional[str] = Header(None)):
+    check_profiling_admin(x_admin_token)
+    profile = profile_store.get(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profil non trouvé")
+    # Format « folded stacks », utilisable par flamegraph.pl ou speedscope
+    return profile.folded()
 
 # Include the router in the main app
 app.include_router(api_router)
@@ -216,6 +298,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Ajouté en dernier pour englober toute la requête
+app.add_middleware(
+    ProfilingMiddleware,
+    store=profile_store,
+    admin_token=profiling_admin_token,
+    sample_rate=float(os.environ.get('PROFILING_SAMPLE_RATE', 0.0)),
+)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -223,6 +313,27 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+migration_task: Optional[asyncio.Task] = None
+
+def log_migration_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception():
+        logger.error("Échec des migrations de schéma", exc_info=task.exception())
+
+@app.on_event("startup")
+async def run_pending_migrations():
+    # Migrations en ligne, en tâche de fond : les lecteurs gèrent les versions mixtes entre-temps
+    global migration_task
+    if os.environ.get('RUN_MIGRATIONS_ON_STARTUP', 'false').lower() == 'true':
+        migration_task = asyncio.create_task(run_all_migrations(
+            db,
+            batch_size=int(os.environ.get('MIGRATION_BATCH_SIZE', 500)),
+            pause=float(os.environ.get('MIGRATION_PAUSE_SECONDS', 0.1)),
+        ))
+        migration_task.add_done_callback(log_migration_failure)
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    if migration_task and not migration_task.done():
+        migration_task.cancel()
+        await asyncio.gather(migration_task, return_exceptions=True)
     client.close()
\ No newline at end of file
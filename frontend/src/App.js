@@ -53,18 +53,19 @@ function App() {
     }
   };
 
-  const loadDevis = async () => {
+  // fresh : relecture sur le primaire juste après une écriture
+  const loadDevis = async (fresh = false) => {
     try {
-      const response = await axios.get(`${API}/devis`);
+      const response = await axios.get(`${API}/devis`, { params: fresh ? { fresh: true } : {} });
       setDevisList(response.data);
     } catch (error) {
       console.error("Erreur lors du chargement des devis:", error);
     }
   };
 
-  const loadFactures = async () => {
+  const loadFactures = async (fresh = false) => {
     try {
-      const response = await axios.get(`${API}/factures`);
+      const response = await axios.get(`${API}/factures`, { params: fresh ? { fresh: true } : {} });
       setFacturesList(response.data);
     } catch (error) {
       console.error("Erreur lors du chargement des factures:", error);
@@ -99,7 +100,7 @@ function App() {
         nombre_kilometres: "",
         nombre_heures: ""
       });
-      loadDevis();
+      loadDevis(true);
     } catch (error) {
       console.error("Erreur lors de la création du devis:", error);
       alert("Erreur lors de la création du devis");
@@ -110,8 +111,8 @@ function App() {
     try {
       await axios.put(`${API}/devis/${devisId}/convert-to-facture`);
       alert("Devis converti en facture avec succès !");
-      loadDevis();
-      loadFactures();
+      loadDevis(true);
+      loadFactures(true);
     } catch (error) {
       console.error("Erreur lors de la conversion:", error);
       alert("Erreur lors de la conversion en facture");
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Le backend se lance depuis son dossier (uvicorn server:app) : ses modules s'importent à plat
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
@@ -0,0 +1,39 @@
+#!/usr/bin/env bash
+# Démarre un replica set local à trois nœuds pour tests/test_read_preference.py.
+#
+#   tests/start_replica_set.sh          # démarre rs0 sur localhost:27117-27119
+#   tests/start_replica_set.sh stop     # arrête les trois mongod
+#
+# Puis :
+#   MONGO_REPLICA_SET_URL="mongodb://localhost:27117,localhost:27118,localhost:27119/?replicaSet=rs0" \
+#       python -m pytest tests/test_read_preference.py
+set -euo pipefail
+
+PORTS=(27117 27118 27119)
+DATA_DIR="${REPLICA_SET_DATA_DIR:-/tmp/vtc-rs0}"
+
+if [ "${1:-}" = "stop" ]; then
+    for port in "${PORTS[@]}"; do
+        mongod --dbpath "$DATA_DIR/$port" --shutdown || true
+    done
+    exit 0
+fi
+
+for port in "${PORTS[@]}"; do
+    mkdir -p "$DATA_DIR/$port"
+    mongod --replSet rs0 --port "$port" --bind_ip localhost --dbpath "$DATA_DIR/$port" \
+        --logpath "$DATA_DIR/$port.log" --fork
+done
+
+mongosh --quiet --port "${PORTS[0]}" --eval '
+rs.initiate({
+  _id: "rs0",
+  members: [
+    { _id: 0, host: "localhost:27117", priority: 2 },
+    { _id: 1, host: "localhost:27118" },
+    { _id: 2, host: "localhost:27119" }
+  ]
+});
+while (!db.hello().isWritablePrimary) { sleep(500); }
+'
+echo "Replica set rs0 prêt"
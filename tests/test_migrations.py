@@ -0,0 +1,183 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+import migrations
+from migrations import (
+    _build_update,
+    current_version,
+    run_all_migrations,
+    euros_to_cents,
+    multiply_cents,
+    run_migration,
+    upgrade_document,
+)
+from server import devis_from_document
+
+DEVIS_V2 = next(m for m in migrations.MIGRATIONS if m.name == "devis_v2")
+DEVIS_V3 = next(m for m in migrations.MIGRATIONS if m.name == "devis_v3")
+
+
+def legacy_devis(**overrides):
+    # Document tel qu'écrit avant le versionnement (calculs en float)
+    doc = {
+        "id": "devis-1",
+        "numero_devis": "DEV-20250101-0001",
+        "date_creation": datetime(2025, 1, 1),
+        "date_validite": datetime(2025, 1, 31),
+        "client": {"nom": "Dupont", "prenom": "Jean", "adresse": "Paris", "telephone": "0102030405", "email": "j@d.fr"},
+        "type_prestation": "transfert",
+        "nombre_kilometres": 33.3,
+        "prix_unitaire": 2.15,
+        "prix_ht": 33.3 * 2.15,
+        "taux_tva": 0.10,
+        "montant_tva": 33.3 * 2.15 * 0.10,
+        "prix_ttc": 33.3 * 2.15 * 1.10,
+        "is_facture": True,
+        "created_at": datetime(2025, 1, 1),
+    }
+    doc.update(overrides)
+    return doc
+
+
+def test_euros_to_cents_rounds_half_up():
+    assert euros_to_cents(2.15) == 215
+    assert euros_to_cents(78.7545) == 7875
+    assert euros_to_cents(0.005) == 1
+    assert euros_to_cents("10") == 1000
+
+
+def test_multiply_cents():
+    assert multiply_cents(250, 40) == 10000
+    assert multiply_cents(215, 33.3) == 7160
+    assert multiply_cents(1999, 0.2) == 400
+
+
+def test_upgrade_document_keeps_legacy_fields_and_stored_amounts():
+    doc = upgrade_document("devis", legacy_devis())
+    assert doc["schema_version"] == 2
+    assert doc["prix_ttc_cents"] == 7875
+    assert doc["prix_ht_cents"] == 7159
+    # Expand : les anciennes instances lisent encore les montants en euros
+    assert doc["prix_ttc"] == pytest.approx(78.7545)
+
+
+def test_current_version_ignores_contract_migrations():
+    assert current_version("devis") == 2
+    assert upgrade_document("devis", {"schema_version": 2, "prix_ttc": 1.0})["prix_ttc"] == 1.0
+
+
+def test_devis_from_document_mixed_versions():
+    facture = devis_from_document(legacy_devis())
+    # Le montant d'une facture émise ne change pas à la migration
+    assert facture.prix_ttc == 78.75
+    assert facture.prix_ht == 71.59
+
+    v2 = upgrade_document("devis", legacy_devis(id="devis-2"))
+    v3 = {k: v for k, v in v2.items() if k not in migrations.DEVIS_MONEY_FIELDS}
+    v3["schema_version"] = 3
+    for doc in (v2, v3):
+        devis = devis_from_document(dict(doc))
+        assert (devis.prix_unitaire, devis.prix_ht, devis.prix_ttc) == (2.15, 71.59, 78.75)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def make_db(count):
+    db = AsyncMongoMockClient()["test"]
+    run(db.devis.insert_many([legacy_devis(_id=i, id=f"devis-{i}") for i in range(count)]))
+    return db
+
+
+def record_calls(monkeypatch, migration):
+    seen = []
+    up = migration.up
+
+    def recording_up(doc):
+        seen.append(doc["_id"])
+        return up(doc)
+
+    monkeypatch.setattr(migration, "up", recording_up)
+    return seen
+
+
+def test_run_migration_in_batches():
+    db = make_db(5)
+    assert run(run_migration(db, DEVIS_V2, batch_size=2, pause=0)) == 5
+    assert run(db.devis.count_documents({"schema_version": 2})) == 5
+    state = run(db.migrations_state.find_one({"_id": "devis_v2"}))
+    assert state["status"] == "done" and state["migrated"] == 5 and state["lease_until"] is None
+
+
+def test_run_migration_resumes_from_last_id_then_sweeps(monkeypatch):
+    db = make_db(5)
+    run(db.migrations_state.insert_one({"_id": "devis_v2", "status": "failed", "last_id": 2}))
+    seen = record_calls(monkeypatch, DEVIS_V2)
+    run(run_migration(db, DEVIS_V2, batch_size=2, pause=0))
+    # Reprise après last_id, puis passage final depuis le début
+    assert seen == [3, 4, 0, 1, 2]
+
+
+def test_update_is_conditional_on_version():
+    # L'application a réécrit le document en v2 entre la lecture du lot et l'écriture
+    collection = mongomock.MongoClient()["test"]["devis"]
+    legacy = legacy_devis(_id=0)
+    collection.insert_one(dict(legacy, schema_version=2, prix_ttc_cents=1))
+
+    result = collection.bulk_write([_build_update(DEVIS_V2, legacy)])
+    assert result.modified_count == 0
+    assert collection.find_one({"_id": 0})["prix_ttc_cents"] == 1
+
+
+def test_run_migration_respects_lease():
+    db = make_db(1)
+    lease = datetime.utcnow() + timedelta(seconds=60)
+    run(db.migrations_state.insert_one({"_id": "devis_v2", "status": "running", "lease_until": lease}))
+    assert run(run_migration(db, DEVIS_V2, pause=0)) is None
+    assert run(db.devis.count_documents({"schema_version": 2})) == 0
+
+    run(db.migrations_state.update_one({"_id": "devis_v2"}, {"$set": {"lease_until": datetime.utcnow() - timedelta(seconds=1)}}))
+    assert run(run_migration(db, DEVIS_V2, pause=0)) == 1
+
+
+def test_rerun_after_done_migrates_late_v1_documents():
+    db = make_db(2)
+    run(run_migration(db, DEVIS_V2, pause=0))
+    assert run(run_migration(db, DEVIS_V2, pause=0)) == 0
+
+    # Document inséré par une ancienne instance pendant le déploiement
+    run(db.devis.insert_one(legacy_devis(_id=-1, id="devis-late")))
+    assert run(run_migration(db, DEVIS_V2, pause=0)) == 1
+
+
+def test_contract_migration_on_v1_document_applies_whole_chain():
+    db = make_db(1)
+    run(run_migration(db, DEVIS_V3, pause=0))
+
+    doc = run(db.devis.find_one({"_id": 0}))
+    assert doc["schema_version"] == 3
+    assert "prix_ttc" not in doc and doc["prix_ttc_cents"] == 7875
+    assert devis_from_document(doc).prix_ttc == 78.75
+
+
+def test_run_all_migrations_stops_on_unfinished_migration():
+    db = make_db(1)
+    lease = datetime.utcnow() + timedelta(seconds=60)
+    run(db.migrations_state.insert_one({"_id": "devis_v2", "status": "running", "lease_until": lease}))
+    run(run_all_migrations(db, pause=0, include_contract=True))
+
+    # v2 est détenue par une autre instance : v3 ne doit pas passer
+    assert run(db.migrations_state.find_one({"_id": "devis_v3"})) is None
+    assert run(db.devis.count_documents({"schema_version": 3})) == 0
+
+
+def test_run_migration_indexes_schema_version():
+    db = make_db(1)
+    run(run_migration(db, DEVIS_V2, pause=0))
+    indexes = run(db.devis.index_information())
+    assert any(index["key"] == [("schema_version", 1)] for index in indexes.values())
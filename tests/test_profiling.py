@@ -0,0 +1,86 @@
+import asyncio
+
+import httpx
+
+import profiling
+import server
+from profiling import ProfileStore, ProfilingMiddleware, RequestProfile
+
+
+async def slow_app(scope, receive, send):
+    await asyncio.sleep(0.05)
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+def call(middleware, headers=()):
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": "/api/devis", "headers": list(headers)}
+    asyncio.run(middleware(scope, receive, send))
+    return messages
+
+
+def test_no_sampler_when_disabled(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("aucun échantillonneur ne doit démarrer")
+
+    monkeypatch.setattr(profiling, "_Sampler", fail)
+    store = ProfileStore(10)
+    call(ProfilingMiddleware(slow_app, store), headers=[(b"x-profile", b"secret")])
+    assert store.list() == []
+
+
+def test_profile_header_stores_profile():
+    store = ProfileStore(10)
+    messages = call(ProfilingMiddleware(slow_app, store, admin_token="secret"), headers=[(b"x-profile", b"secret")])
+
+    [profile] = store.list()
+    assert (b"x-profile-id", profile.id.encode()) in messages[0]["headers"]
+    assert profile.path == "/api/devis" and profile.duration_ms >= 50
+
+
+def test_wrong_token_is_not_profiled():
+    store = ProfileStore(10)
+    call(ProfilingMiddleware(slow_app, store, admin_token="secret"), headers=[(b"x-profile", b"nope")])
+    assert store.list() == []
+
+
+def test_store_evicts_oldest_profiles():
+    store = ProfileStore(2)
+    profiles = [RequestProfile("GET", f"/{i}") for i in range(3)]
+    for profile in profiles:
+        store.add(profile)
+
+    assert store.list() == [profiles[2], profiles[1]]
+    assert store.get(profiles[0].id) is None
+
+
+def test_folded_shows_awaited_leaf():
+    store = ProfileStore(10)
+    call(ProfilingMiddleware(slow_app, store, admin_token="secret"), headers=[(b"x-profile", b"secret")])
+
+    folded = store.list()[0].folded()
+    assert any(
+        "slow_app" in line and line.rsplit(" ", 1)[0].split(";")[-1].startswith("<await ")
+        for line in folded.splitlines()
+    )
+
+
+def test_admin_routes_require_token(monkeypatch):
+    monkeypatch.setattr(server, "profiling_admin_token", "secret")
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as api:
+            assert (await api.get("/api/admin/profiles")).status_code == 403
+            assert (await api.get("/api/admin/profiles/abc", headers={"X-Admin-Token": "nope"})).status_code == 403
+            assert (await api.get("/api/admin/profiles", headers={"X-Admin-Token": "secret"})).status_code == 200
+
+    asyncio.run(scenario())
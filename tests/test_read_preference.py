@@ -0,0 +1,117 @@
+"""
+Routage des lectures vers les secondaires.
+
+Les tests marqués `replica_set` nécessitent un replica set à trois nœuds
+(tests/start_replica_set.sh) et l'URL correspondante dans MONGO_REPLICA_SET_URL.
+"""
+
+import asyncio
+import os
+
+import httpx
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+
+import server
+
+REPLICA_SET_URL = os.environ.get("MONGO_REPLICA_SET_URL")
+replica_set = pytest.mark.skipif(not REPLICA_SET_URL, reason="MONGO_REPLICA_SET_URL non défini")
+
+COMPANY = {
+    "nom_societe": "VTC Test",
+    "numero_siret": "12345678901234",
+    "adresse": "Paris",
+    "telephone": "0102030405",
+    "email": "contact@vtctest.com",
+}
+DEVIS = {
+    "client": {"nom": "Dupont", "prenom": "Jean", "adresse": "Paris", "telephone": "0102030405", "email": "j@d.fr"},
+    "type_prestation": "transfert",
+    "nombre_kilometres": 40,
+}
+
+
+def test_list_routes_use_secondary_preferred():
+    assert server.list_db(False).read_preference.document == {
+        "mode": "secondaryPreferred",
+        "maxStalenessSeconds": server.read_max_staleness,
+    }
+    assert server.list_db(False) is server.secondary_db
+    assert server.list_db(True) is server.db
+
+
+class Recorder(monitoring.CommandListener):
+    def __init__(self):
+        self.events = []
+
+    def started(self, event):
+        self.events.append(event)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def find_commands(self):
+        return [event for event in self.events if event.command_name == "find" and event.command.get("find") == "devis"]
+
+
+async def call_api(monkeypatch, scenario):
+    recorder = Recorder()
+    mongo_client = AsyncIOMotorClient(REPLICA_SET_URL, event_listeners=[recorder])
+    db_name = os.environ["DB_NAME"] + "_read_preference"
+    monkeypatch.setenv("DB_NAME", db_name)
+    monkeypatch.setattr(server, "db", mongo_client[db_name])
+    monkeypatch.setattr(server, "secondary_db", server.secondary_database(mongo_client))
+    await mongo_client.drop_database(db_name)
+    await server.db.company_settings.insert_one(dict(COMPANY, id="settings", tarif_transfert_km=2.5))
+    try:
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as api:
+            await mongo_client.admin.command("ping")
+            primary = mongo_client.primary
+            return await scenario(api, recorder, primary)
+    finally:
+        await mongo_client.drop_database(db_name)
+        mongo_client.close()
+
+
+@replica_set
+@pytest.mark.parametrize("path", ["/api/devis", "/api/factures"])
+def test_list_routes_read_from_secondaries(monkeypatch, path):
+    async def scenario(api, recorder, primary):
+        response = await api.get(path)
+        assert response.status_code == 200
+        assert recorder.find_commands()[-1].connection_id != primary
+
+    asyncio.run(call_api(monkeypatch, scenario))
+
+
+@replica_set
+def test_get_devis_after_create_reads_primary(monkeypatch):
+    async def scenario(api, recorder, primary):
+        created = (await api.post("/api/devis", json=DEVIS)).json()
+        response = await api.get(f"/api/devis/{created['id']}")
+        assert response.status_code == 200
+        assert recorder.find_commands()[-1].connection_id == primary
+
+    asyncio.run(call_api(monkeypatch, scenario))
+
+
+@replica_set
+def test_create_then_list_returns_new_devis(monkeypatch):
+    async def scenario(api, recorder, primary):
+        created = (await api.post("/api/devis", json=DEVIS)).json()
+        response = await api.get("/api/devis", params={"fresh": True})
+        assert created["id"] in [devis["id"] for devis in response.json()]
+        assert recorder.find_commands()[-1].connection_id == primary
+
+    asyncio.run(call_api(monkeypatch, scenario))
+
+
+def test_max_staleness_below_minimum_is_rejected():
+    assert server.parse_read_max_staleness("120") == 120
+    with pytest.raises(ValueError, match="READ_MAX_STALENESS_SECONDS"):
+        server.parse_read_max_staleness("30")